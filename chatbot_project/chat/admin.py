@@ -1,12 +1,105 @@
 # chat/admin.py
 
+import csv
+from functools import lru_cache
+
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.functions import Substr
+from django.forms.models import BaseInlineFormSet
+from django.http import StreamingHttpResponse
+from django.urls import get_script_prefix, reverse
+from django.utils.functional import cached_property
 from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from .models import Conversation, ClassificationResult
 
 
+# --- Shared Helpers ---
+
+def truncated_preview(preview, max_len):
+    """
+    Formats a `_preview` annotation, which holds the first max_len + 1 characters of the text
+    (one extra character tells whether the text was cut).
+    """
+    return preview[:max_len] + '...' if len(preview) > max_len else preview
+
+
+class DeferredFieldsChangeList(ChangeList):
+    """
+    Changelist that never loads the model admin's `changelist_deferred_fields`: large columns
+    no list column renders. The change view still loads them in full through get_object().
+    """
+
+    def get_queryset(self, request, *args, **kwargs):
+        queryset = super().get_queryset(request, *args, **kwargs)
+        return queryset.defer(*self.model_admin.changelist_deferred_fields)
+
+
+class LargeTablePaginator(Paginator):
+    """
+    Paginator for unbounded log tables. On PostgreSQL an unfiltered changelist reports the
+    planner's row estimate (pg_class.reltuples) instead of running COUNT(*) over the whole
+    table; small tables, tables never analyzed (reltuples = -1), filtered querysets and other
+    databases are still counted exactly.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'postgresql' and not query.where:
+            with connection.cursor() as cursor:
+                # regclass resolves the table through the search_path, like the query itself
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                    [connection.ops.quote_name(query.model._meta.db_table)]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+def conversation_change_url(conversation_pk):
+    """
+    Admin change-page URL of a conversation. The URL pattern is reversed once and then
+    reused as a format string, since the changelist links a conversation on every row.
+    """
+    return _conversation_change_url_template(get_script_prefix()).format(conversation_pk)
+
+
+@lru_cache(maxsize=None)
+def _conversation_change_url_template(script_prefix):
+    # Keyed by script prefix because reverse() includes it in the URL
+    return reverse("admin:chat_conversation_change", args=[0]).replace('/0/', '/{}/')
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer: writerow() returns the formatted line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
 # --- 1. Inline for Classification Results ---
 
+class RecentClassificationResultFormSet(BaseInlineFormSet):
+    """
+    Limits the inline to the most recent `max_num` log entries of a conversation.
+    """
+
+    def get_queryset(self):
+        # Slice after the formset has filtered by conversation (a sliced queryset can't be filtered),
+        # and keep the same object so the rows are fetched once for all forms.
+        if not hasattr(self, '_recent_queryset'):
+            self._recent_queryset = super().get_queryset()[:self.max_num]
+        return self._recent_queryset
+
+
 class ClassificationResultInline(admin.TabularInline):
     """
     Displays the ClassificationResult logs directly within the Conversation view.
@@ -28,17 +121,39 @@ class ClassificationResultInline(admin.TabularInline):
     )
     extra = 0  # Do not show extra empty forms for log entries
     can_delete = False
+    # Only the latest log entries are rendered, however long the conversation gets
+    max_num = 50
+    formset = RecentClassificationResultFormSet
+
+    preview_length = 70
+
+    def get_queryset(self, request):
+        # The inline renders str(obj), which reads conversation.session_id for every row.
+        # Only the start of response_message is fetched; the database truncates it.
+        return super().get_queryset(request).select_related('conversation').only(
+            'id', 'timestamp', 'topic', 'escalation_status',
+            'conversation__id', 'conversation__session_id',
+        ).annotate(
+            _preview=Substr('response_message', 1, self.preview_length + 1)
+        ).order_by('-timestamp')
 
     # Custom method to truncate long response messages for display
     def response_message_preview(self, obj):
-        max_len = 70
-        return obj.response_message[:max_len] + '...' if len(obj.response_message) > max_len else obj.response_message
+        return truncated_preview(obj._preview, self.preview_length)
 
     response_message_preview.short_description = 'Response Preview'
 
 
 # --- 2. Admin for Conversation Model ---
 
+# Message blocks of the detail view's transcript, by capitalized role
+MESSAGE_TEMPLATES = {
+    'User': '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #007bff; background-color: #f8f9fa;"><strong>User:</strong> {}</div>',
+    'Assistant': '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #28a745; background-color: #e9f7ef;"><strong>Assistant:</strong> {}</div>',
+    'Unknown': '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #ffc107; background-color: #fff3cd;"><strong>Unknown Role:</strong> {}</div>',
+}
+
+
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     """
@@ -62,39 +177,29 @@ class ConversationAdmin(admin.ModelAdmin):
 
     # Custom method to display a truncated session ID
     def session_id_short(self, obj):
-        return f"{obj.session_id[:8]}..."
+        return f"{str(obj.session_id)[:8]}..."
 
     session_id_short.short_description = 'Session ID'
 
     # Custom method to count the number of turns (user + assistant messages)
     def turn_count(self, obj):
-        # The history is a list of dicts; count the items
-        return len(obj.history) if obj.history else 0
+        return obj.message_count
 
     turn_count.short_description = 'Turns'
+    turn_count.admin_order_field = 'message_count'
 
     # Custom method to display the full conversation history beautifully
     def conversation_history_display(self, obj):
-        html = ""
-        for message in obj.history:
-            role = message.get('role', 'unknown').capitalize()
-            content = message.get('content', '')
-
+        parts = []
+        append = parts.append
+        messages = obj.messages.order_by('seq').values_list('role', 'content')
+        for role, content in messages.iterator(chunk_size=200):
             # Use format_html to render a simple, readable message block
-            if role == 'User':
-                html += format_html(
-                    '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #007bff; background-color: #f8f9fa;"><strong>User:</strong> {}</div>',
-                    content)
-            elif role == 'Assistant':
-                html += format_html(
-                    '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #28a745; background-color: #e9f7ef;"><strong>Assistant:</strong> {}</div>',
-                    content)
-            else:
-                html += format_html(
-                    '<div style="margin-bottom: 10px; padding: 5px; border-left: 3px solid #ffc107; background-color: #fff3cd;"><strong>Unknown Role:</strong> {}</div>',
-                    content)
-
-        return html
+            template = MESSAGE_TEMPLATES.get(role.capitalize(), MESSAGE_TEMPLATES['Unknown'])
+            append(format_html(template, content))
+
+        # Every part is already escaped by format_html; join once instead of growing a string
+        return mark_safe(''.join(parts))
 
     conversation_history_display.short_description = 'Full Conversation History'
 
@@ -113,16 +218,66 @@ class ClassificationResultAdmin(admin.ModelAdmin):
     readonly_fields = ['conversation', 'timestamp', 'topic', 'escalation_status', 'response_message']
     date_hierarchy = 'timestamp'
 
+    # conversation_link reads the related Conversation on every row; JOIN it in the
+    # changelist query instead of issuing one extra SELECT per row.
+    list_select_related = ('conversation',)
+
+    # The list only shows a preview of response_message, truncated by the database
+    changelist_deferred_fields = ('response_message',)
+    preview_length = 50
+
+    # The log table grows without bound: don't count it on every page render
+    show_full_result_count = False
+    paginator = LargeTablePaginator
+
+    actions = ['export_as_csv']
+
+    # Columns written by export_as_csv (header label, queryset field)
+    export_columns = (
+        ('Timestamp', 'timestamp'),
+        ('Session ID', 'conversation__session_id'),
+        ('Topic', 'topic'),
+        ('Escalation Status', 'escalation_status'),
+        ('Response Message', 'response_message'),
+    )
+
+    def get_changelist(self, request, **kwargs):
+        return DeferredFieldsChangeList
+
+    def get_queryset(self, request):
+        # Only pull the two Conversation columns the list actually reads
+        return super().get_queryset(request).only(
+            'id', 'timestamp', 'topic', 'escalation_status', 'response_message',
+            'conversation__id', 'conversation__session_id',
+        ).annotate(_preview=Substr('response_message', 1, self.preview_length + 1))
+
     # Custom method to display a hyperlinked Session ID
     def conversation_link(self, obj):
-        from django.urls import reverse
-        link = reverse("admin:chat_conversation_change", args=[obj.conversation.pk])
-        return format_html('<a href="{}">{}</a>', link, obj.conversation.session_id[:8] + '...')
+        link = conversation_change_url(obj.conversation_id)
+        return format_html('<a href="{}">{}</a>', link, str(obj.conversation.session_id)[:8] + '...')
 
     conversation_link.short_description = 'Session'
 
     # Custom method to preview content in the list view
     def response_message_preview_list(self, obj):
-        return obj.response_message[:50] + '...' if len(obj.response_message) > 50 else obj.response_message
+        return truncated_preview(obj._preview, self.preview_length)
 
     response_message_preview_list.short_description = 'Response Preview'
+
+    @admin.action(description='Export selected log entries as CSV')
+    def export_as_csv(self, request, queryset):
+        # Rows are streamed in chunks, so memory stays bounded however many entries are selected
+        rows = queryset.values_list(*(field for _, field in self.export_columns)).iterator(chunk_size=500)
+        writer = csv.writer(Echo())
+
+        def lines():
+            yield writer.writerow([label for label, _ in self.export_columns])
+            for row in rows:
+                yield writer.writerow(row)
+
+        return StreamingHttpResponse(
+            lines(),
+            content_type='text/csv',
+            headers={'Content-Disposition': 'attachment; filename="classification_results.csv"'},
+        )
+
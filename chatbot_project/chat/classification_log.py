@@ -0,0 +1,142 @@
+# chat/classification_log.py
+
+import atexit
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import ClassificationResult
+
+# --- Background Writer Configuration ---
+# Log entries are written in batches of up to BATCH_SIZE, at most FLUSH_INTERVAL seconds after
+# the first entry of the batch was queued.
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 0.5  # seconds
+QUEUE_MAX_SIZE = 10000
+SHUTDOWN_TIMEOUT = 5  # seconds
+
+# Queued by shutdown(): the writer stores the batch it is holding and exits
+_STOP = object()
+
+_log_queue = queue.Queue(maxsize=QUEUE_MAX_SIZE)
+_worker = None
+_worker_lock = threading.Lock()
+
+
+# --- 1. Public API ---
+
+def log_classification(conversation, topic, escalation_status, response_message):
+    """
+    Records a ClassificationResult off the request's critical path.
+
+    The entry is handed to a background writer once the surrounding transaction commits (so
+    the conversation row is visible to the writer's connection), and inserted with
+    bulk_create together with other pending entries. With CLASSIFICATION_LOG_ASYNC disabled
+    the entry is saved synchronously instead.
+    """
+    entry = ClassificationResult(
+        conversation=conversation,
+        topic=topic,
+        escalation_status=escalation_status,
+        response_message=response_message,
+    )
+    if not getattr(settings, 'CLASSIFICATION_LOG_ASYNC', True):
+        entry.save()
+        return
+    transaction.on_commit(lambda: _enqueue(entry))
+
+
+def flush():
+    """Synchronously writes every entry still waiting in the queue."""
+    batch = []
+    while True:
+        try:
+            entry = _log_queue.get_nowait()
+        except queue.Empty:
+            break
+        if entry is not _STOP:
+            batch.append(entry)
+    if batch:
+        _write_batch(batch)
+
+
+def shutdown():
+    """
+    Stops the background writer once it has stored the batch it is holding, then writes what
+    is left in the queue. Registered to run at interpreter exit (server reloads, worker
+    restarts), so queued entries aren't lost with the daemon thread.
+    """
+    worker = _worker
+    if worker is not None and worker.is_alive():
+        try:
+            _log_queue.put(_STOP, timeout=SHUTDOWN_TIMEOUT)
+        except queue.Full:
+            pass
+        worker.join(SHUTDOWN_TIMEOUT)
+    flush()
+
+
+# --- 2. Background Writer ---
+
+def _enqueue(entry):
+    _ensure_worker()
+    try:
+        _log_queue.put_nowait(entry)
+    except queue.Full:
+        # The writer can't keep up: fall back to a synchronous insert rather than dropping the entry
+        entry.save()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name='classification-log-writer', daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        entry = _log_queue.get()
+        if entry is _STOP:
+            return
+        batch = [entry]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = _log_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                _write_batch(batch)
+                return
+            batch.append(entry)
+        _write_batch(batch)
+
+
+def _write_batch(batch):
+    try:
+        ClassificationResult.objects.bulk_create(batch)
+    except Exception as e:
+        # e.g. "database is locked" on SQLite, where the writer competes with the request
+        # threads: retry the entries one by one, so only those that still fail are lost
+        print(f"Classification Log Batch Write Failure ({len(batch)} entries, saving one by one): {e}")
+        for entry in batch:
+            try:
+                entry.save()
+            except Exception as e:
+                print(f"Classification Log Write Failure (entry dropped): {e}")
+    finally:
+        # The writer thread holds its own DB connection; recycle it if it has gone stale
+        close_old_connections()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,28 @@
+# chat/loop_local.py
+
+import asyncio
+import weakref
+
+
+class LoopLocal:
+    """
+    Holds one object per event loop, created by `factory` the first time it is needed on a
+    loop.
+
+    Async SDK clients keep pooled connections bound to the loop that opened them. Under WSGI
+    every request to an async view runs in a new event loop (async_to_sync), so a client
+    shared at module level fails on any later request; each loop gets its own client instead.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        # Entries go away with their loop
+        self._objects = weakref.WeakKeyDictionary()
+
+    def get(self):
+        """Returns the object of the running event loop."""
+        loop = asyncio.get_running_loop()
+        obj = self._objects.get(loop)
+        if obj is None:
+            obj = self._objects[loop] = self._factory()
+        return obj
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_update_models'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='classificationresult',
+            index=models.Index(fields=['conversation', '-timestamp'], name='chat_conv_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+import uuid
+
+from django.db import migrations
+
+# Frozen copy of chat.models.LEGACY_SESSION_NAMESPACE
+LEGACY_SESSION_NAMESPACE = uuid.UUID('6e8509cb-cfea-4e31-9c98-275de58d600f')
+
+
+def normalize_session_ids(apps, schema_editor):
+    """
+    Rewrites every session_id as a 32-character UUID hex string, the form every backend can
+    convert in place when the column becomes a UUIDField in the next migration. Ids that are
+    not UUIDs are mapped with uuid5, the same way chat.models.parse_session_id does.
+    """
+    Conversation = apps.get_model('chat', 'Conversation')
+    for conversation in Conversation.objects.only('id', 'session_id').iterator():
+        try:
+            session_uuid = uuid.UUID(conversation.session_id)
+        except ValueError:
+            session_uuid = uuid.uuid5(LEGACY_SESSION_NAMESPACE, conversation.session_id)
+        if conversation.session_id != session_uuid.hex:
+            Conversation.objects.filter(pk=conversation.pk).update(session_id=session_uuid.hex)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_classificationresult_chat_conv_ts_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_session_ids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+import uuid
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_normalize_conversation_session_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='session_id',
+            field=models.UUIDField(db_index=True, default=uuid.uuid4, help_text='Unique identifier for the chat session.', unique=True),
+        ),
+    ]
@@ -0,0 +1,56 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_history_to_messages(apps, schema_editor):
+    """Moves each conversation's JSON history into Message rows, keeping the list order as seq."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.only('id', 'history').iterator(chunk_size=200):
+        Message.objects.bulk_create([
+            Message(
+                conversation_id=conversation.pk,
+                role=str(message.get('role', 'unknown'))[:10],
+                content=message.get('content', ''),
+                seq=seq,
+            )
+            for seq, message in enumerate(conversation.history or [])
+        ])
+
+
+def copy_messages_to_history(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    for conversation in Conversation.objects.only('id').iterator(chunk_size=200):
+        conversation.history = [
+            {'role': role, 'content': content}
+            for role, content in Message.objects.filter(conversation_id=conversation.pk)
+            .order_by('seq').values_list('role', 'content')
+        ]
+        conversation.save(update_fields=['history'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_alter_conversation_session_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(help_text='Who sent the message: user or assistant.', max_length=10)),
+                ('content', models.TextField()),
+                ('seq', models.PositiveIntegerField(help_text='Position of the message within its conversation, starting at 0.')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(help_text='The conversation the message belongs to.', on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='chat.conversation')),
+            ],
+            options={
+                'ordering': ['seq'],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'seq'), name='chat_message_conv_seq_uniq')],
+            },
+        ),
+        migrations.RunPython(copy_history_to_messages, copy_messages_to_history),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_messages(apps, schema_editor):
+    """Fills message_count from the Message rows stored so far."""
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    counts = Message.objects.filter(conversation=OuterRef('pk')).values('conversation').annotate(
+        count=Count('*')
+    ).values('count')
+    Conversation.objects.update(message_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_remove_conversation_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of messages stored for the conversation.'),
+        ),
+        migrations.RunPython(count_messages, migrations.RunPython.noop),
+    ]
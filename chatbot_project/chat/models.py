@@ -4,11 +4,24 @@ import uuid
 from .llm_schemas import TopicCategory, Status
 
 
-# --- Helper Function for Unique Default ---
+# --- Helper Function for Session IDs ---
 
-def generate_uuid():
-    """Generates a new, unique UUID for the session_id field."""
-    return str(uuid.uuid4())
+# Namespace for mapping legacy, non-UUID session ids (e.g. 'session_<timestamp><random>') to UUIDs
+LEGACY_SESSION_NAMESPACE = uuid.UUID('6e8509cb-cfea-4e31-9c98-275de58d600f')
+
+
+def parse_session_id(value):
+    """
+    Converts a client-supplied session id to the UUID stored in Conversation.session_id.
+    Legacy ids that are not UUIDs are mapped deterministically with uuid5, so a client
+    keeps the same conversation across requests.
+    """
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.uuid5(LEGACY_SESSION_NAMESPACE, str(value))
 
 
 # --- Constant Definitions (Django Field Choices) ---
@@ -30,17 +43,21 @@ ESCALATION_STATUS_CHOICES = [
 # --- 1. Conversation Model ---
 
 class Conversation(models.Model):
-    """Stores the full conversation history for a session."""
+    """A chat session; its transcript is stored one row per message in Message."""
 
-    session_id = models.CharField(
-        max_length=255,
+    session_id = models.UUIDField(
         unique=True,
         db_index=True,
-        default=generate_uuid,
-        help_text="Unique identifier for the chat session, usually a UUID."
+        default=uuid.uuid4,
+        help_text="Unique identifier for the chat session."
     )
 
-    history = models.JSONField(default=list)
+    # Kept up to date by the code that stores messages, so listing conversations with their
+    # length doesn't aggregate the Message table
+    message_count = models.PositiveIntegerField(
+        default=0,
+        help_text="Number of messages stored for the conversation."
+    )
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -52,7 +69,45 @@ class Conversation(models.Model):
         return f"Session: {self.session_id}"
 
 
-# --- 2. Classification Result Model (Logging) ---
+# --- 2. Message Model ---
+
+class Message(models.Model):
+    """
+    A single message of a conversation. Each turn inserts its own rows instead of rewriting
+    the whole transcript, and the transcript can be read (or paginated) in `seq` order.
+    """
+    conversation = models.ForeignKey(
+        Conversation,
+        on_delete=models.CASCADE,
+        related_name='messages',
+        help_text="The conversation the message belongs to."
+    )
+
+    role = models.CharField(
+        max_length=10,
+        help_text="Who sent the message: user or assistant."
+    )
+
+    content = models.TextField()
+
+    seq = models.PositiveIntegerField(
+        help_text="Position of the message within its conversation, starting at 0."
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index for reading a transcript in order
+            models.UniqueConstraint(fields=['conversation', 'seq'], name='chat_message_conv_seq_uniq'),
+        ]
+        ordering = ['seq']
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
+
+
+# --- 3. Classification Result Model (Logging) ---
 
 class ClassificationResult(models.Model):
     """
@@ -86,6 +141,8 @@ class ClassificationResult(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['topic', 'escalation_status']),
+            # Serves "latest logs of a conversation" (the admin inline) straight from the index
+            models.Index(fields=['conversation', '-timestamp'], name='chat_conv_ts_idx'),
         ]
         ordering = ['-timestamp']
 
@@ -0,0 +1,36 @@
+# chat/single_flight.py
+
+import asyncio
+import weakref
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent requests for the same key into one call: the first caller starts
+    the work, and every caller that arrives while it is in flight awaits the same result.
+
+    Used to share one LLM classification between identical transcripts (client retries,
+    double submits) that land before the first answer has reached the cache.
+    """
+
+    def __init__(self):
+        # Tasks belong to the event loop that created them, so in-flight work is tracked per
+        # loop (under WSGI every request runs in its own loop)
+        self._in_flight = weakref.WeakKeyDictionary()
+
+    async def submit(self, key, factory):
+        """Returns the result of `await factory()`, sharing it with concurrent callers of `key`."""
+        loop = asyncio.get_running_loop()
+        in_flight = self._in_flight.setdefault(loop, {})
+
+        task = in_flight.get(key)
+        if task is None:
+            task = loop.create_task(factory())
+            in_flight[key] = task
+            task.add_done_callback(lambda _: in_flight.pop(key, None))
+
+        # A caller that gets cancelled (e.g. client disconnect) must not cancel the shared call
+        return await asyncio.shield(task)
+
+
+classification_single_flight = SingleFlight()
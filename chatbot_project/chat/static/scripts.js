@@ -2,7 +2,11 @@ let sessionId = localStorage.getItem('chatSessionId');
 
 // Initialize session ID if not present
 if (!sessionId) {
-    sessionId = 'session_' + Date.now() + Math.random().toString(36).substring(2, 9);
+    // Sessions are keyed by UUID on the server; crypto.randomUUID() needs a secure context
+    // (HTTPS or localhost), otherwise fall back to a legacy id the server maps to a UUID.
+    sessionId = window.crypto && crypto.randomUUID
+        ? crypto.randomUUID()
+        : 'session_' + Date.now() + Math.random().toString(36).substring(2, 9);
     localStorage.setItem('chatSessionId', sessionId);
 }
 
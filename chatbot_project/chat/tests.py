@@ -1,31 +1,76 @@
 """
 Updated tests for the chat application matching current models and endpoints.
 """
-from django.test import TestCase, Client
+import asyncio
+import csv
+import queue
+import socketserver
+import threading
+import time
+import uuid
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib import admin
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, OperationalError, transaction
+
+from . import classification_log
+from .admin import ClassificationResultAdmin, LargeTablePaginator
+from .llm_schemas import ClassificationOutput, TopicCategory, Status
+from .loop_local import LoopLocal
+from .models import Conversation, Message, ClassificationResult, parse_session_id
+from .views import append_messages, build_history_str, get_llm_classification
+
 
-from .models import Conversation, ClassificationResult
+def classified(response_message, topic=TopicCategory.OTHERS):
+    """A successful classification, as returned by a mocked get_llm_classification."""
+    return ClassificationOutput(
+        topic=topic,
+        status=Status.CLASSIFIED,
+        response_message=response_message,
+        confidence=0.9,
+        justification='Test classification.'
+    )
 
 
 class ChatModelTests(TestCase):
-    """Test cases for chat models (Conversation & ClassificationResult)."""
+    """Test cases for chat models (Conversation, Message & ClassificationResult)."""
 
-    def test_conversation_creation_and_history(self):
-        conversation = Conversation.objects.create(session_id='test-session')
-        self.assertEqual(conversation.session_id, 'test-session')
+    def test_conversation_creation_and_messages(self):
+        conversation = Conversation.objects.create()
+        self.assertIsInstance(conversation.session_id, uuid.UUID)
         self.assertIsNotNone(conversation.created_at)
-        self.assertEqual(conversation.history, [])
+        self.assertFalse(conversation.messages.exists())
 
-        # Append a message and verify persistence
-        conversation.history.append({'role': 'user', 'content': 'Hello'})
-        conversation.save()
+        # Add a message and verify persistence
+        Message.objects.create(conversation=conversation, role='user', content='Hello', seq=0)
+        self.assertEqual(conversation.messages.count(), 1)
+        self.assertEqual(conversation.messages.get().content, 'Hello')
+
+    def test_append_messages_numbers_after_existing_messages(self):
+        conversation = Conversation.objects.create()
+        Message.objects.create(conversation=conversation, role='user', content='Hello', seq=0)
+        append_messages(conversation.pk, 1, [
+            {'role': 'assistant', 'content': 'Hi, how can I help?'},
+            {'role': 'user', 'content': 'Lab results'},
+        ])
+        # A stale first_seq (a concurrent turn took seq 1) appends after the last message
+        stored_at = append_messages(conversation.pk, 1, [{'role': 'assistant', 'content': 'Sure.'}])
+        self.assertEqual(stored_at, 3)
+        self.assertEqual(
+            list(conversation.messages.values_list('seq', 'content')),
+            [(0, 'Hello'), (1, 'Hi, how can I help?'), (2, 'Lab results'), (3, 'Sure.')]
+        )
+        # The message created directly above isn't counted; only appended messages are
         conversation.refresh_from_db()
-        self.assertEqual(len(conversation.history), 1)
-        self.assertEqual(conversation.history[0]['content'], 'Hello')
+        self.assertEqual(conversation.message_count, 3)
 
     def test_classification_result_creation(self):
-        conversation = Conversation.objects.create(session_id='test-session-2', history=[])
+        conversation = Conversation.objects.create()
         result = ClassificationResult.objects.create(
             conversation=conversation,
             topic='OTHERS',
@@ -37,11 +82,143 @@ class ChatModelTests(TestCase):
         self.assertTrue(result.response_message.startswith('Test'))
 
 
+class ClassificationResultAdminTests(TestCase):
+    """Test cases for the ClassificationResult admin (paginator and CSV export)."""
+
+    def setUp(self):
+        self.conversation = Conversation.objects.create()
+        ClassificationResult.objects.create(
+            conversation=self.conversation,
+            topic='LAB',
+            escalation_status='classified',
+            response_message='Your lab, "Main St", is booked.'
+        )
+
+    def _paginator_count(self, reltuples, queryset=None):
+        # Runs LargeTablePaginator as on PostgreSQL, with `reltuples` as the planner's estimate
+        connection = mock.MagicMock(vendor='postgresql')
+        connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (reltuples,)
+        queryset = ClassificationResult.objects.all() if queryset is None else queryset
+        with mock.patch('chat.admin.connections', {'default': connection}):
+            count = LargeTablePaginator(queryset, 100).count
+        return count, cursor
+
+    def test_paginator_reports_estimate_for_large_tables(self):
+        count, cursor = self._paginator_count(2500000.0)
+        self.assertEqual(count, 2500000)
+        cursor.execute.assert_called_once_with(
+            "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", ['"chat_classificationresult"']
+        )
+
+    def test_paginator_counts_small_unanalyzed_or_filtered_tables(self):
+        self.assertEqual(self._paginator_count(50.0)[0], 1)
+        # reltuples is -1 until the table is first analyzed (PostgreSQL 14+)
+        self.assertEqual(self._paginator_count(-1.0)[0], 1)
+
+        count, cursor = self._paginator_count(
+            2500000.0, ClassificationResult.objects.filter(topic='OTHERS')
+        )
+        self.assertEqual(count, 0)
+        cursor.execute.assert_not_called()
+
+    def test_export_as_csv(self):
+        model_admin = ClassificationResultAdmin(ClassificationResult, admin.site)
+        request = RequestFactory().post('/')
+        response = model_admin.export_as_csv(request, ClassificationResult.objects.all())
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], ['Timestamp', 'Session ID', 'Topic', 'Escalation Status', 'Response Message'])
+        self.assertEqual(
+            rows[1][1:],
+            [str(self.conversation.session_id), 'LAB', 'classified', 'Your lab, "Main St", is booked.']
+        )
+        self.assertEqual(len(rows), 2)
+
+
+@override_settings(CLASSIFICATION_LOG_ASYNC=True)
+class ClassificationLogWriterTests(TransactionTestCase):
+    """Test cases for the background writer of classification_log (needs committed rows)."""
+
+    def test_queued_entries_are_written_in_batches(self):
+        conversation = Conversation.objects.create()
+        count = classification_log.BATCH_SIZE + 50
+        with transaction.atomic():
+            for _ in range(count):
+                classification_log.log_classification(
+                    conversation, topic='OTHERS', escalation_status='classified', response_message='Hi'
+                )
+            # Entries are handed to the writer only once the transaction commits
+            self.assertEqual(classification_log._log_queue.qsize(), 0)
+
+        deadline = time.monotonic() + 5
+        while conversation.classifications.count() < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(conversation.classifications.count(), count)
+
+    def test_shutdown_writes_the_batch_held_by_the_writer(self):
+        conversation = Conversation.objects.create()
+        # The writer holds what it took from the queue until the flush interval ends
+        with mock.patch.object(classification_log, 'FLUSH_INTERVAL', 60):
+            with transaction.atomic():
+                for _ in range(3):
+                    classification_log.log_classification(
+                        conversation, topic='OTHERS', escalation_status='classified', response_message='Hi'
+                    )
+            deadline = time.monotonic() + 5
+            while classification_log._log_queue.qsize() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(conversation.classifications.count(), 0)
+
+            classification_log.shutdown()
+        self.assertEqual(conversation.classifications.count(), 3)
+        self.assertFalse(classification_log._worker.is_alive())
+
+
+class ClassificationLogFallbackTests(TestCase):
+    """Test cases for the synchronous paths of classification_log."""
+
+    @override_settings(CLASSIFICATION_LOG_ASYNC=True)
+    def test_full_queue_saves_synchronously_and_flush_writes_the_rest(self):
+        conversation = Conversation.objects.create()
+        # No writer thread drains the one-slot queue: the first entry waits in it, the others
+        # are saved on the spot
+        with mock.patch.object(classification_log, '_log_queue', queue.Queue(maxsize=1)), \
+                mock.patch.object(classification_log, '_ensure_worker'):
+            with self.captureOnCommitCallbacks(execute=True):
+                for topic in ['LAB', 'TWIN_APPOINTMENT', 'OTHERS']:
+                    classification_log.log_classification(
+                        conversation, topic=topic, escalation_status='classified', response_message='Hi'
+                    )
+            self.assertEqual(sorted(conversation.classifications.values_list('topic', flat=True)), ['OTHERS', 'TWIN_APPOINTMENT'])
+
+            classification_log.flush()
+        self.assertEqual(conversation.classifications.count(), 3)
+
+    def test_failed_batch_is_saved_entry_by_entry(self):
+        conversation = Conversation.objects.create()
+        batch = [
+            ClassificationResult(conversation=conversation, topic='OTHERS',
+                                 escalation_status='classified', response_message='Hi')
+            for _ in range(2)
+        ]
+        with mock.patch.object(ClassificationResult.objects, 'bulk_create',
+                               side_effect=OperationalError('database is locked')):
+            classification_log._write_batch(batch)
+        self.assertEqual(conversation.classifications.count(), 2)
+
+
+# Log entries are saved synchronously so the assertions below can see them
+@override_settings(CLASSIFICATION_LOG_ASYNC=False)
 class ChatViewTests(TestCase):
     """Test cases for chat views."""
 
     def setUp(self):
         self.client = Client()
+        # Cached transcripts outlive the per-test database rollback
+        cache.clear()
 
     def test_index_view(self):
         # Name is 'chatbot_home' in chat/urls.py
@@ -50,6 +227,7 @@ class ChatViewTests(TestCase):
 
     def test_chat_api_generic_ack(self):
         # First message "ok" should trigger OTHERS + no_response without LLM call
+        # Legacy, non-UUID session ids are still accepted
         payload = {"message": "ok", "session_id": "unit-session"}
         response = self.client.post(reverse('chat_api'), data=payload, content_type='application/json')
         self.assertEqual(response.status_code, 200)
@@ -57,5 +235,216 @@ class ChatViewTests(TestCase):
         self.assertEqual(data['topic'], 'OTHERS')
         self.assertEqual(data['status'], 'no_response')
 
+        conversation = Conversation.objects.get(session_id=parse_session_id('unit-session'))
+        self.assertEqual(list(conversation.messages.values_list('role', 'content')), [('user', 'ok')])
+        self.assertEqual(conversation.message_count, 1)
+        self.assertEqual(conversation.classifications.get().escalation_status, 'no_response')
+
+    def test_chat_api_generic_ack_is_atomic(self):
+        # A failed message insert must not leave an empty conversation behind, or later
+        # acknowledgements in the session would no longer count as the first message
+        with mock.patch.object(Message.objects, 'create', side_effect=DatabaseError('insert failed')):
+            response = self.client.post(
+                reverse('chat_api'),
+                data={"message": "ok", "session_id": str(uuid.uuid4())},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertFalse(Conversation.objects.exists())
+
+    @mock.patch('chat.views.get_llm_classification')
+    def test_chat_api_generic_ack_on_session_created_concurrently(self, mock_classify):
+        mock_classify.return_value = classified('Glad to help.')
+        # Another request starts the session between the EXISTS check and the INSERT, so this
+        # "ok" is not the first message of the session any more
+        conversation = Conversation.objects.create()
+        with mock.patch('django.db.models.query.QuerySet.aexists', mock.AsyncMock(return_value=False)):
+            response = self.client.post(
+                reverse('chat_api'),
+                data={"message": "ok", "session_id": str(conversation.session_id)},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['response'], 'Glad to help.')
+        self.assertEqual(list(conversation.messages.values_list('role', flat=True)), ['user', 'assistant'])
+
+    @mock.patch('chat.views.get_llm_classification')
+    def test_chat_api_persists_turn(self, mock_classify):
+        mock_classify.return_value = classified('Your lab appointment is confirmed.', topic=TopicCategory.LAB)
+        session_id = str(uuid.uuid4())
+        payload = {"message": "When is my lab appointment?", "session_id": session_id}
+        response = self.client.post(reverse('chat_api'), data=payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['topic'], 'LAB')
+        self.assertEqual(response.json()['session_id'], session_id)
+
+        # Both messages of the turn and its classification log are stored
+        conversation = Conversation.objects.get(session_id=session_id)
+        self.assertEqual(
+            list(conversation.messages.values_list('role', flat=True)),
+            ['user', 'assistant']
+        )
+        self.assertEqual(conversation.message_count, 2)
+        self.assertEqual(conversation.classifications.count(), 1)
+        mock_classify.assert_called_once_with('user: When is my lab appointment?')
+
+    @mock.patch('chat.views.get_llm_classification')
+    def test_chat_api_new_session_created_concurrently(self, mock_classify):
+        mock_classify.return_value = classified('Your lab appointment is confirmed.', topic=TopicCategory.LAB)
+        # Another request creates the session between this request's lookup and its INSERT
+        conversation = Conversation.objects.create()
+        with mock.patch('django.db.models.query.QuerySet.aget', side_effect=Conversation.DoesNotExist):
+            response = self.client.post(
+                reverse('chat_api'),
+                data={"message": "When is my lab appointment?", "session_id": str(conversation.session_id)},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Conversation.objects.count(), 1)
+        self.assertEqual(conversation.messages.count(), 2)
+
+    @mock.patch('chat.views.get_llm_classification')
+    def test_chat_api_prompt_includes_previous_turns(self, mock_classify):
+        mock_classify.return_value = classified('Hello!')
+        session_id = str(uuid.uuid4())
+        for message in ['Hi', 'Is my lab booked?']:
+            self.client.post(
+                reverse('chat_api'),
+                data={"message": message, "session_id": session_id},
+                content_type='application/json'
+            )
+        mock_classify.assert_called_with('user: Hi\nassistant: Hello!\nuser: Is my lab booked?')
+
+    @override_settings(LLM_HISTORY_MAX_MESSAGES=3)
+    @mock.patch('chat.views.get_llm_classification')
+    def test_chat_api_prompt_keeps_only_recent_messages(self, mock_classify):
+        mock_classify.return_value = classified('Noted.')
+        session_id = str(uuid.uuid4())
+        for turn, message in enumerate(['One', 'Two', 'Three']):
+            if turn == 2:
+                # The window is rebuilt from the database when the cache is cold
+                cache.clear()
+            self.client.post(
+                reverse('chat_api'),
+                data={"message": message, "session_id": session_id},
+                content_type='application/json'
+            )
+        mock_classify.assert_called_with(
+            '(2 earlier messages omitted.)\nuser: Two\nassistant: Noted.\nuser: Three'
+        )
+
+    @override_settings(LLM_HISTORY_MAX_CHARS=20)
+    def test_build_history_str_respects_char_budget(self):
+        lines = ['user: Hello there', 'assistant: Hi', 'user: A very long latest message']
+        self.assertEqual(
+            build_history_str(lines, 3),
+            '(2 earlier messages omitted.)\nuser: A very long latest message'
+        )
+
+
+@override_settings(LLM_PROVIDER='Gemini', LLM_MODEL='test-model')
+class LLMClassificationTests(TestCase):
+    """Test cases for get_llm_classification."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_identical_history_is_classified_once(self):
+        client = mock.MagicMock()
+        client.aio.models.generate_content = mock.AsyncMock(return_value=mock.Mock(text=(
+            '{"topic": "LAB", "status": "classified", "response_message": "Booked.", '
+            '"confidence": 0.9, "justification": "Lab booking."}'
+        )))
+        with mock.patch('chat.views.GEMINI_CLIENT', LoopLocal(lambda: client)):
+            first = async_to_sync(get_llm_classification)('user: Book my lab')
+            second = async_to_sync(get_llm_classification)('user: Book my lab')
+
+        self.assertEqual(first, second)
+        self.assertEqual(second.topic, TopicCategory.LAB)
+        client.aio.models.generate_content.assert_awaited_once()
+
+    def test_prompt_change_invalidates_cached_result(self):
+        client = mock.MagicMock()
+        client.aio.models.generate_content = mock.AsyncMock(return_value=mock.Mock(text=(
+            '{"topic": "LAB", "status": "classified", "response_message": "Booked.", '
+            '"confidence": 0.9, "justification": "Lab booking."}'
+        )))
+        with mock.patch('chat.views.GEMINI_CLIENT', LoopLocal(lambda: client)):
+            async_to_sync(get_llm_classification)('user: Book my lab')
+            # A deployment with an updated knowledge base must not reuse the cached answer
+            with mock.patch('chat.views.PROMPT_DIGEST', 'updated'):
+                async_to_sync(get_llm_classification)('user: Book my lab')
+
+        self.assertEqual(client.aio.models.generate_content.await_count, 2)
+
+    def test_fallback_result_is_not_cached(self):
+        client = mock.MagicMock()
+        client.aio.models.generate_content = mock.AsyncMock(side_effect=ConnectionError('down'))
+        with mock.patch('chat.views.GEMINI_CLIENT', LoopLocal(lambda: client)):
+            async_to_sync(get_llm_classification)('user: Book my lab')
+            result = async_to_sync(get_llm_classification)('user: Book my lab')
+
+        self.assertEqual(result.confidence, 0.0)
+        self.assertEqual(client.aio.models.generate_content.await_count, 2)
+
+    def test_concurrent_identical_requests_share_one_call(self):
+        async def slow_response(**kwargs):
+            await asyncio.sleep(0.01)
+            return mock.Mock(text=(
+                '{"topic": "OTHERS", "status": "classified", "response_message": "Hi!", '
+                '"confidence": 0.8, "justification": "Greeting."}'
+            ))
+
+        async def classify_twice():
+            return await asyncio.gather(
+                get_llm_classification('user: Hello'),
+                get_llm_classification('user: Hello'),
+            )
+
+        client = mock.MagicMock()
+        client.aio.models.generate_content = mock.AsyncMock(side_effect=slow_response)
+        with mock.patch('chat.views.GEMINI_CLIENT', LoopLocal(lambda: client)):
+            first, second = async_to_sync(classify_twice)()
+
+        self.assertEqual(first, second)
+        client.aio.models.generate_content.assert_awaited_once()
+
+    def test_client_connections_survive_a_new_event_loop(self):
+        # Under WSGI each request runs async_to_sync in a new event loop; a client holding a
+        # pooled connection opened on an earlier loop must not be reused there
+        class EchoHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    self.wfile.write(line)
+
+        server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), EchoHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        class PooledModels:
+            """Answers generate_content over one kept-alive connection, like the SDK clients."""
+            connection = None
+
+            async def generate_content(self, **kwargs):
+                if self.connection is None:
+                    self.connection = await asyncio.open_connection(*server.server_address)
+                reader, writer = self.connection
+                writer.write(b'{"topic": "LAB", "status": "classified", "response_message": "Booked.", '
+                             b'"confidence": 0.9, "justification": "Lab booking."}\n')
+                await writer.drain()
+                return mock.Mock(text=(await reader.readline()).decode())
+
+        def make_client():
+            client = mock.Mock()
+            client.aio.models = PooledModels()
+            return client
+
+        with mock.patch('chat.views.GEMINI_CLIENT', LoopLocal(make_client)):
+            first = async_to_sync(get_llm_classification)('user: Book my lab')
+            second = async_to_sync(get_llm_classification)('user: Book my lab again')
 
-        
+        # Neither call fell back to the system error result
+        self.assertEqual(first.topic, TopicCategory.LAB)
+        self.assertEqual(second.topic, TopicCategory.LAB)
@@ -3,54 +3,122 @@
 import os
 import json
 import uuid
+import hashlib
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Now
 from pydantic import ValidationError  # Used for robust JSON validation
 
+from .loop_local import LoopLocal
+
 # --- Provider-Specific Imports ---
 # Use conditional imports based on project settings (Gemini is recommended)
 try:
     from google import genai
     from google.genai import types
 
-    GEMINI_CLIENT = genai.Client(api_key=settings.LLM_API_KEY) if settings.LLM_PROVIDER == 'Gemini' else None
+    # One client per event loop (see LoopLocal). Under ASGI, the supported server, that is a
+    # single client whose HTTP connection pool is reused by every request of the worker
+    GEMINI_CLIENT = LoopLocal(
+        lambda: genai.Client(api_key=settings.LLM_API_KEY)
+    ) if settings.LLM_PROVIDER == 'Gemini' else None
 except ImportError:
     GEMINI_CLIENT = None
 
 try:
-    from openai import OpenAI
+    from openai import AsyncOpenAI
 
-    # Initialize the OpenAI client globally if the provider is OpenAI
-    OPENAI_CLIENT = OpenAI(api_key=settings.LLM_API_KEY) if settings.LLM_PROVIDER == 'OpenAI' else None
+    # Initialize the OpenAI client if the provider is OpenAI; reusing a client keeps its HTTP
+    # connection pool (and TLS sessions) alive across the requests of an event loop
+    OPENAI_CLIENT = LoopLocal(
+        lambda: AsyncOpenAI(api_key=settings.LLM_API_KEY)
+    ) if settings.LLM_PROVIDER == 'OpenAI' else None
 except ImportError:
     OPENAI_CLIENT = None
 
 # --- Custom Imports (Assuming these files are correct and available) ---
-from .models import Conversation, ClassificationResult
+from .models import Conversation, Message, parse_session_id
+from .single_flight import classification_single_flight
+from .classification_log import log_classification
 from .knowledge_base import LLM_RAG_CONTEXT  # This should contain the RAG rules/instructions
 from .llm_schemas import ClassificationOutput, PYTHON_ESCALATION_MESSAGES, TopicCategory, Status
 
+# First-message acknowledgements that get no reply (see the OTHERS rule in the knowledge base)
+GENERIC_ACKS = frozenset({'ok', 'okay', 'thanks', 'thank you', 'thx', 'k'})
+
+# --- Invariant Prompt Pieces ---
+# The system message and output schema never change between requests, so they are built
+# once at import time instead of on every classification call.
+SYSTEM_MESSAGE = (
+    f"{LLM_RAG_CONTEXT}\n\n"
+    "Your task is strictly to analyze the conversation and output a JSON object "
+    "that adheres to the provided schema. DO NOT generate any free-form text or preamble."
+)
+CLASSIFICATION_SCHEMA = ClassificationOutput.model_json_schema()
+
+GEMINI_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=CLASSIFICATION_SCHEMA,
+    temperature=0.0,
+    system_instruction=SYSTEM_MESSAGE,
+) if GEMINI_CLIENT else None
+
 
 # --------------------------------------------------------------------------------
 # 1. CORE LLM LOGIC: STRUCTURED CLASSIFICATION
 # --------------------------------------------------------------------------------
 
-def get_llm_classification(history_str: str) -> ClassificationOutput:
+# Classifications run at temperature 0.0, so an identical transcript (client retries, re-sent
+# messages) gets the cached result instead of another LLM round trip
+CLASSIFICATION_CACHE_TIMEOUT = 60 * 60
+
+# Part of every cache key: a changed knowledge base or schema must not be answered from
+# entries cached (possibly in a shared cache) by the previous deployment
+PROMPT_DIGEST = hashlib.blake2b(
+    f"{SYSTEM_MESSAGE}\n{json.dumps(CLASSIFICATION_SCHEMA, sort_keys=True)}".encode('utf-8'), digest_size=8
+).hexdigest()
+
+
+def _classification_cache_key(provider, model_name, history_str):
+    digest = hashlib.blake2b(
+        f"{provider}:{model_name}:{PROMPT_DIGEST}:{history_str}".encode('utf-8'), digest_size=16
+    ).hexdigest()
+    return f"chat:classification:{digest}"
+
+
+async def get_llm_classification(history_str: str) -> ClassificationOutput:
     """
-    Interacts with the configured LLM (Gemini or OpenAI) for structured classification.
+    Returns the structured classification of a conversation transcript, from the cache when
+    possible. Concurrent requests for the same transcript share a single LLM call.
     """
     provider = settings.LLM_PROVIDER
     model_name = settings.LLM_MODEL
 
-    # 1. Prepare the full prompt by combining RAG context and conversation history
-    # We maintain a system and user message structure for clarity
-    system_message = (
-        f"{LLM_RAG_CONTEXT}\n\n"
-        "Your task is strictly to analyze the conversation and output a JSON object "
-        "that adheres to the provided schema. DO NOT generate any free-form text or preamble."
+    cache_key = _classification_cache_key(provider, model_name, history_str)
+    cached_result = await cache.aget(cache_key)
+    if cached_result is not None:
+        return cached_result
+
+    return await classification_single_flight.submit(
+        cache_key,
+        lambda: request_llm_classification(history_str, provider, model_name, cache_key)
     )
+
+
+async def request_llm_classification(history_str, provider, model_name, cache_key) -> ClassificationOutput:
+    """
+    Interacts with the configured LLM (Gemini or OpenAI) for structured classification.
+    Uses the SDKs' async clients, so the worker is free to serve other requests while the
+    LLM call is in flight.
+    """
+    # 1. Prepare the full prompt by combining RAG context (SYSTEM_MESSAGE) and conversation history
+    # We maintain a system and user message structure for clarity
     user_message = (
         "Analyze the following conversation history and classify the topic.\n"
         "**Conversation History:**\n"
@@ -63,23 +131,13 @@ def get_llm_classification(history_str: str) -> ClassificationOutput:
     try:
         if provider == 'Gemini' and GEMINI_CLIENT:
             # --- GEMINI Implementation (Structured Output) ---
-            # Valid roles: 'user' and 'model'. Use system_instruction for system content.
-
-            schema = ClassificationOutput.model_json_schema()
-
-            config = types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=schema,
-                temperature=0.0,
-                system_instruction=system_message,
-            )
-
-            response = GEMINI_CLIENT.models.generate_content(
+            # Valid roles: 'user' and 'model'. The system content travels in GEMINI_CONFIG.
+            response = await GEMINI_CLIENT.get().aio.models.generate_content(
                 model=model_name,
                 contents=[
                     {"role": "user", "parts": [{"text": user_message}]},
                 ],
-                config=config,
+                config=GEMINI_CONFIG,
             )
             llm_result_json = response.text
 
@@ -89,16 +147,16 @@ def get_llm_classification(history_str: str) -> ClassificationOutput:
             # Requires GPT-4o models (or latest gpt-4) and uses `response_format`
 
             messages = [
-                {"role": "system", "content": system_message},
+                {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "user", "content": user_message},
             ]
 
-            response = OPENAI_CLIENT.chat.completions.create(
+            response = await OPENAI_CLIENT.get().chat.completions.create(
                 model=model_name,
                 messages=messages,
                 temperature=0.0,
                 # Enforce JSON output format with the new structured output features
-                response_format={"type": "json_object", "json_schema": ClassificationOutput.model_json_schema()}
+                response_format={"type": "json_object", "json_schema": CLASSIFICATION_SCHEMA}
             )
             llm_result_json = response.choices[0].message.content
 
@@ -111,7 +169,10 @@ def get_llm_classification(history_str: str) -> ClassificationOutput:
             raise ValueError("LLM returned an empty response.")
 
         # Pydantic validates the JSON against the schema and converts it to an object
-        return ClassificationOutput.model_validate_json(llm_result_json)
+        llm_result = ClassificationOutput.model_validate_json(llm_result_json)
+        # Only genuine answers are cached; the fallbacks below must be retried next time
+        await cache.aset(cache_key, llm_result, CLASSIFICATION_CACHE_TIMEOUT)
+        return llm_result
 
     except (ValidationError, json.JSONDecodeError, ValueError) as e:
         print(f"LLM Output Parse/Config Failure: {e} | Raw Output: {llm_result_json}")
@@ -136,7 +197,142 @@ def get_llm_classification(history_str: str) -> ClassificationOutput:
 
 
 # --------------------------------------------------------------------------------
-# 2. DJANGO VIEWS
+# 2. PERSISTENCE HELPERS
+# --------------------------------------------------------------------------------
+
+def append_messages(conversation_pk, first_seq, messages):
+    """
+    Stores `messages` (dicts with role and content) as Message rows numbered from `first_seq`
+    and bumps the conversation's updated_at and message_count, in one transaction.
+    If a concurrent turn of the same session already took those positions (unique
+    conversation/seq constraint), the messages are stored after the current last one instead.
+    Returns the seq the first message was stored at.
+    """
+    try:
+        _insert_messages(conversation_pk, first_seq, messages)
+        return first_seq
+    except IntegrityError:
+        last_seq = Message.objects.filter(conversation_id=conversation_pk).aggregate(last=Max('seq'))['last']
+        first_seq = last_seq + 1
+        _insert_messages(conversation_pk, first_seq, messages)
+        return first_seq
+
+
+def _insert_messages(conversation_pk, first_seq, messages):
+    with transaction.atomic():
+        Message.objects.bulk_create([
+            Message(conversation_id=conversation_pk, seq=first_seq + offset, **message)
+            for offset, message in enumerate(messages)
+        ])
+        Conversation.objects.filter(pk=conversation_pk).update(
+            updated_at=Now(), message_count=F('message_count') + len(messages)
+        )
+
+
+# The formatted lines of a conversation's recent messages are cached so each turn only reads
+# and formats the messages stored since
+HISTORY_CACHE_TIMEOUT = 60 * 60
+
+
+def _history_cache_key(conversation_pk):
+    return f"chat:recent_history:{conversation_pk}"
+
+
+async def load_recent_history(conversation):
+    """
+    Returns (message_count, lines): the number of messages stored for the conversation and
+    the "role: content" lines of the last LLM_HISTORY_MAX_MESSAGES of them.
+
+    The cached window of the previous turn records how many messages it covers, so only
+    messages with a higher seq are read; without a cache entry only the last rows are queried.
+    """
+    max_messages = settings.LLM_HISTORY_MAX_MESSAGES
+    cached = await cache.aget(_history_cache_key(conversation.pk))
+
+    # Model instances rather than values_list(): the latter's aiterator() runs its query
+    # eagerly in the async context
+    messages = conversation.messages.only('seq', 'role', 'content')
+    if cached is not None:
+        message_count, lines = cached
+        lines = list(lines)
+        new_messages = [m async for m in messages.filter(seq__gte=message_count).order_by('seq').aiterator()]
+    else:
+        message_count, lines = 0, []
+        new_messages = [m async for m in messages.order_by('-seq')[:max_messages].aiterator()]
+        new_messages.reverse()
+
+    for message in new_messages:
+        lines.append(f"{message.role}: {message.content}")
+        message_count = message.seq + 1
+    return message_count, lines[-max_messages:]
+
+
+async def cache_recent_history(conversation_pk, message_count, lines):
+    """Stores the window of lines ending with message `message_count - 1` of the conversation."""
+    lines = tuple(lines[-settings.LLM_HISTORY_MAX_MESSAGES:])
+    await cache.aset(_history_cache_key(conversation_pk), (message_count, lines), HISTORY_CACHE_TIMEOUT)
+
+
+def build_history_str(lines, message_count):
+    """
+    Joins the last LLM_HISTORY_MAX_MESSAGES lines, as far as they fit in LLM_HISTORY_MAX_CHARS,
+    into the prompt transcript, so the prompt size (and LLM latency/cost) stays bounded however
+    long the session gets. `message_count` is the number of messages the lines end at.
+    The latest line is always kept; a note tells the LLM when earlier messages were left out.
+    """
+    kept, size = [], 0
+    for line in reversed(lines[-settings.LLM_HISTORY_MAX_MESSAGES:]):
+        size += len(line) + 1
+        if kept and size > settings.LLM_HISTORY_MAX_CHARS:
+            break
+        kept.append(line)
+    kept.reverse()
+
+    if len(kept) < message_count:
+        kept.insert(0, f"({message_count - len(kept)} earlier messages omitted.)")
+    return "\n".join(kept)
+
+
+def record_first_ack(session_id, user_entry, escalation_status):
+    """
+    Starts a conversation whose first message is a generic acknowledgement: the conversation,
+    its first Message and the classification log entry are stored in one transaction, so a
+    failed insert cannot leave an empty conversation behind.
+    Returns False (storing nothing) if a concurrent request already started the session.
+    """
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.create(session_id=session_id, message_count=1)
+            Message.objects.create(conversation=conversation, seq=0, **user_entry)
+            log_classification(
+                conversation,
+                topic='OTHERS',
+                escalation_status=escalation_status,
+                response_message='NO_RESPONSE_ACK',
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def record_turn(conversation, first_seq, messages, topic, escalation_status, response_message):
+    """
+    Persists one chat turn: the new Message rows (on the request path) and the classification
+    log entry (queued for the background writer in classification_log).
+    Returns the seq the turn's first message was stored at (see append_messages).
+    """
+    stored_at = append_messages(conversation.pk, first_seq, messages)
+    log_classification(
+        conversation,
+        topic=topic,
+        escalation_status=escalation_status,
+        response_message=response_message,
+    )
+    return stored_at
+
+
+# --------------------------------------------------------------------------------
+# 3. DJANGO VIEWS
 # --------------------------------------------------------------------------------
 
 def chatbot_view(request):
@@ -145,8 +341,12 @@ def chatbot_view(request):
 
 
 @csrf_exempt
-def chat_api(request):
-    """API endpoint to process user messages and run the classification/RAG logic."""
+async def chat_api(request):
+    """
+    API endpoint to process user messages and run the classification/RAG logic.
+    The view is async: while the LLM call is awaited, the worker serves other requests
+    (run under ASGI, see chatbot_project/asgi.py, to get that concurrency).
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
@@ -155,43 +355,50 @@ def chat_api(request):
         user_message = data.get('message', '').strip()
         session_id = data.get('session_id')
 
-        if not session_id:
-            session_id = str(uuid.uuid4())
+        # session_id is a UUID column; ids from older clients are mapped onto a stable UUID
+        session_id = parse_session_id(session_id) if session_id else uuid.uuid4()
 
-        # --- 3.1 Fetch/Update Conversation History ---
-        conversation, created = Conversation.objects.get_or_create(
-            session_id=session_id,
-            defaults={'history': []}
-        )
-        conversation.history.append({'role': 'user', 'content': user_message})
-        # Save the user message immediately, before processing
-        conversation.save()
+        user_entry = {'role': 'user', 'content': user_message}
 
-        # --- 3.2 Check for OTHERS/Acknowledgement Exception (Python Logic) ---
-        is_generic_ack = user_message.lower() in ['ok', 'okay', 'thanks']
-        is_first_message = len(conversation.history) == 1
+        # --- 3.1 Check for OTHERS/Acknowledgement Exception (Python Logic) ---
+        # A generic acknowledgement as the first message of a session gets no reply. The
+        # check runs before the conversation lookup so this path costs one EXISTS query and
+        # the INSERTs it has to make anyway.
+        is_generic_ack = user_message.lower() in GENERIC_ACKS
 
-        if is_generic_ack and is_first_message:
+        if is_generic_ack and not await Conversation.objects.filter(session_id=session_id).aexists():
             ack_rule = PYTHON_ESCALATION_MESSAGES["generic_ack"]
-            response_data = {
-                'topic': 'OTHERS',
-                'status': ack_rule['status'],  # 'no_response'
-                'response': ''  # Empty response
-            }
-            # Log the classification result for auditing
-            ClassificationResult.objects.create(
-                conversation=conversation,
-                topic='OTHERS',
-                escalation_status=ack_rule['status'],
-                response_message='NO_RESPONSE_ACK',
-            )
-            return JsonResponse(response_data)
+            # Store the user message and log the classification result for auditing
+            # (transactional, so run sync). If a concurrent request started the session first,
+            # this is not its first message and it takes the normal path below.
+            if await sync_to_async(record_first_ack)(session_id, user_entry, ack_rule['status']):
+                response_data = {
+                    'topic': 'OTHERS',
+                    'status': ack_rule['status'],  # 'no_response'
+                    'response': ''  # Empty response
+                }
+                return JsonResponse(response_data)
+
+        # --- 3.2 Fetch Conversation History ---
+        # Existing sessions are the common case: a plain lookup on the unique session_id index,
+        # loading only the primary key and skipping get_or_create's savepoint. A new session
+        # goes through get_or_create, which recovers if a concurrent request (e.g. a double
+        # submit) creates the same session first.
+        try:
+            conversation = await Conversation.objects.only('id').aget(session_id=session_id)
+        except Conversation.DoesNotExist:
+            conversation, _ = await Conversation.objects.aget_or_create(session_id=session_id)
+
+        # The user message is persisted together with the outcome of this turn below;
+        # here it only extends the prompt transcript.
+        message_count, recent_lines = await load_recent_history(conversation)
+        recent_lines.append(f"user: {user_message}")
+        history_str = build_history_str(recent_lines, message_count + 1)
 
         # --- 3.3 Execute RAG Classification Call ---
-        history_str = "\n".join([f"{m['role']}: {m['content']}" for m in conversation.history])
 
         # Get the structured classification object
-        llm_result: ClassificationOutput = get_llm_classification(history_str)
+        llm_result: ClassificationOutput = await get_llm_classification(history_str)
         response_text = llm_result.response_message
         # Ensure enums are serialized as strings for DB and JSON
         topic_str = llm_result.topic.value if hasattr(llm_result.topic, 'value') else str(llm_result.topic)
@@ -199,24 +406,30 @@ def chat_api(request):
 
         # --- 3.4 Process and Save Result ---
 
-        # Save the assistant response to the conversation history
-        # (This is the message returned to the user, based on the classification)
-        conversation.history.append({'role': 'assistant', 'content': response_text})
-        conversation.save()
-
-        # Save the classification result for logging
-        ClassificationResult.objects.create(
-            conversation=conversation,
+        # Save the user message and the assistant response to the conversation history
+        # (the response is the message returned to the user, based on the classification),
+        # together with the classification result for logging (transactional, so run sync)
+        stored_at = await sync_to_async(record_turn)(
+            conversation,
+            message_count,
+            [user_entry, {'role': 'assistant', 'content': response_text}],
             topic=topic_str,
             escalation_status=status_str,
             response_message=response_text,
         )
+        # If a concurrent turn got in first, our lines are not the latest stored messages
+        if stored_at == message_count:
+            await cache_recent_history(
+                conversation.pk,
+                message_count + 2,
+                [*recent_lines, f"assistant: {response_text}"]
+            )
 
         # Prepare the final JSON response for the frontend
         response_data = {
             'topic': topic_str,
             'status': status_str,
-            'session_id': session_id,
+            'session_id': str(session_id),
             'response': response_text
         }
         return JsonResponse(response_data)
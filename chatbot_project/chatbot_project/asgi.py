@@ -8,7 +8,14 @@ https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
 
 import os
+from django.conf import settings
+from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_project.settings')
 application = get_asgi_application()
+
+# ASGI is the supported server (the chat API is async); in development it also serves the
+# static files, as runserver would
+if settings.DEBUG:
+    application = ASGIStaticFilesHandler(application)
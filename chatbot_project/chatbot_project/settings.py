@@ -111,6 +111,10 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 86400
 SESSION_SAVE_EVERY_REQUEST = True
 
+# Classification logs are written by a background thread in batches (see chat/classification_log.py).
+# Set to 'False' to insert each log entry synchronously on the request path.
+CLASSIFICATION_LOG_ASYNC = os.getenv('CLASSIFICATION_LOG_ASYNC', 'True') == 'True'
+
 # ----------------------------------------------------
 # 💥 CRITICAL CORRECTION: LLM Configuration
 # ----------------------------------------------------
@@ -135,6 +139,12 @@ else:
     print(f"WARNING: Unsupported LLM_PROVIDER: {LLM_PROVIDER}")
 
 
+# Prompt size bounds: only the last LLM_HISTORY_MAX_MESSAGES messages are sent to the LLM, further
+# cut to LLM_HISTORY_MAX_CHARS characters (~4 characters per token, i.e. ~4000 tokens by default).
+LLM_HISTORY_MAX_MESSAGES = int(os.getenv('LLM_HISTORY_MAX_MESSAGES', '20'))
+LLM_HISTORY_MAX_CHARS = int(os.getenv('LLM_HISTORY_MAX_CHARS', '16000'))
+
+
 # DEBUGGING (Remember to remove for production!)
 # print(f"DEBUG: LLM_PROVIDER: {LLM_PROVIDER}")
 # print(f"DEBUG: LLM_MODEL: {LLM_MODEL}")